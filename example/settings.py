@@ -21,10 +21,31 @@ BUCKET_ASSETS_PREFIX = 'media'
 BUCKET_UPLOADS = 'example-upload-bucket.yourdomain.com'
 BUCKET_UPLOADS_PREFIX = 'media/uploads'
 BUCKET_UPLOADS_PATH = MEDIA_ROOT + '/uploads'
+# Sync both with a single walk: manage.py s3sync_media --job=media
+BUCKET_SYNC_JOBS = {
+    'media': [
+        # Assets, exclude uploads, etc.
+        {'bucket': BUCKET_ASSETS, 'prefix': BUCKET_ASSETS_PREFIX,
+         'exclude_list': ['.*', 'Thumbs.db', 'uploads*', 'less'],
+         'remove_missing': True},
+        # User media
+        {'bucket': BUCKET_UPLOADS, 'prefix': BUCKET_UPLOADS_PREFIX,
+         'dir': BUCKET_UPLOADS_PATH, 'exclude_list': ['.htaccess'],
+         'remove_missing': True},
+    ],
+}
 BUCKET_UPLOADS_URL = '//example-upload-bucket.yourdomain.com/media/'
 BUCKET_UPLOADS_CACHE_ALIAS = 's3-storage'
 BUCKET_UPLOADS_PENDING_KEY = 's3-pending'
 BUCKET_UPLOADS_PENDING_DELETE_KEY = 's3-pending-delete'
+# Upload saved files right away from background threads, the cron catches up
+# on anything these miss.
+BUCKET_UPLOADS_BACKGROUND = True
+BUCKET_UPLOADS_PENDING_PREFIX = 'media'  # same as s3sync_pending --prefix
+BUCKET_UPLOADS_BACKGROUND_THREADS = 2
+BUCKET_UPLOADS_BACKGROUND_QUEUE_SIZE = 100
+# Media is on a shared mount, pick free file names from cache counters.
+BUCKET_UPLOADS_RESERVE_NAMES = True
 
 # S3 Host/Region
 # To connect to your S3 host region, you may want to set this to avoid a BrokenPipeException
@@ -0,0 +1,76 @@
+import json
+import os
+import time
+
+from s3sync.utils import encode_path
+
+
+class DirectoryState(object):
+    """What each directory looked like after the last successful sync.
+
+    For every directory it keeps the mtime, the number of entries and the
+    names of its subdirectories. A directory with the same mtime and entry
+    count has had nothing added, removed or renamed, so its files don't
+    need to be checked again and its subdirectories are known without
+    stat'ing every entry. Files changed in place don't touch the directory
+    mtime, which is what the periodic deep scan is for.
+    """
+
+    def __init__(self, path, params):
+        self.path = path
+        self.params = params
+        self.dirs = {}
+        self.deep_scan = 0
+        self.new_dirs = {}
+
+    def load(self):
+        """Read the state of the last run with the same params.
+
+        Returns False if there is none.
+        """
+        if not os.path.exists(self.path):
+            return False
+        state_file = open(self.path, 'r')
+        try:
+            state = json.load(state_file)
+        except ValueError:
+            return False
+        finally:
+            state_file.close()
+        if state.get('params') != self.params:
+            return False
+        self.dirs = dict((encode_path(dirname), record)
+                         for dirname, record in state['dirs'].items())
+        self.deep_scan = state['deep_scan']
+        return True
+
+    def unchanged(self, dirname, mtime, entries):
+        """Return the recorded subdirectories if dirname is unchanged."""
+        record = self.dirs.get(encode_path(dirname))
+        if record and record[0] == mtime and record[1] == entries:
+            if isinstance(dirname, unicode):
+                return record[2]
+            return [encode_path(name) for name in record[2]]
+        return None
+
+    def record(self, dirname, mtime, entries, subdirs):
+        names = [encode_path(name) for name in [dirname] + subdirs]
+        if None in names:
+            # This one just gets scanned every time.
+            return
+        self.new_dirs[names[0]] = [mtime, entries, names[1:]]
+
+    def save(self, deep_scan=False):
+        """Replace the saved state with the directories recorded this run."""
+        if deep_scan:
+            self.deep_scan = time.time()
+        tmp_path = self.path + '.tmp'
+        state_file = open(tmp_path, 'w')
+        try:
+            json.dump({'params': self.params, 'deep_scan': self.deep_scan,
+                       'dirs': self.new_dirs}, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        finally:
+            state_file.close()
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,159 @@
+import errno
+import fcntl
+import json
+import os
+
+from s3sync.utils import encode_path
+
+
+class JournalLockedError(Exception):
+    pass
+
+
+class SyncJournal(object):
+    """Append-only record of the directories and keys a sync run has
+    completed, so an interrupted run can be resumed where it left off.
+
+    The journal is a file of JSON lines. The first line describes the run
+    (bucket, prefix, directory) so a journal is never resumed against a
+    different target. Every following line is either ``{"k": key}`` for an
+    uploaded key or ``{"d": dirname}`` for a fully synced directory.
+    Lines are flushed as they are written and fsync'd every ``sync_every``
+    entries. A run holds a lock on ``path + '.lock'`` while it uses the
+    journal, so overlapping runs can't overwrite or remove each other's.
+    """
+
+    def __init__(self, path, params, sync_every=100):
+        self.path = path
+        self.params = params
+        self.sync_every = max(int(sync_every), 1)
+        self.dirs = set()
+        self.keys = set()
+        self._file = None
+        self._lock_file = None
+        self._unsynced = 0
+
+    def lock(self):
+        """Take the journal for this run.
+
+        Raises JournalLockedError if another run has it.
+        """
+        # A separate file, the journal itself is replaced and removed.
+        self._lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(self._lock_file.fileno(),
+                        fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            self._lock_file.close()
+            self._lock_file = None
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                raise JournalLockedError(self.path)
+            raise
+
+    def load(self):
+        """Read a previous journal for the same run.
+
+        Returns False if there is no journal or it belongs to another run.
+        """
+        if not os.path.exists(self.path):
+            return False
+        journal_file = open(self.path, 'r')
+        try:
+            lines = journal_file.readlines()
+        finally:
+            journal_file.close()
+        if not lines:
+            return False
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return False
+        if header != self.params:
+            return False
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The process died halfway through writing this line.
+                continue
+            if 'd' in entry:
+                self.dirs.add(encode_path(entry['d']))
+            elif 'k' in entry:
+                self.keys.add(encode_path(entry['k']))
+        return True
+
+    def open(self, resume=False):
+        """Start writing. Appends to the journal when resuming, otherwise
+        starts a fresh one."""
+        if resume:
+            self._file = open(self.path, 'a+')
+            # Terminate a line torn by the interrupted run.
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell():
+                self._file.seek(-1, os.SEEK_END)
+                if self._file.read(1) != '\n':
+                    self._file.write('\n')
+        else:
+            self.dirs = set()
+            self.keys = set()
+            self._file = open(self.path, 'w')
+            self._write(self.params)
+            self.checkpoint()
+
+    def is_key_done(self, key):
+        return encode_path(key) in self.keys
+
+    def is_dir_done(self, dirname):
+        return encode_path(dirname) in self.dirs
+
+    def key_done(self, key):
+        # Undecodable names can't be journaled, they get synced again.
+        key = encode_path(key)
+        if key is not None:
+            self.keys.add(key)
+            self._write({'k': key})
+
+    def dir_done(self, dirname):
+        dirname = encode_path(dirname)
+        if dirname is not None:
+            self.dirs.add(dirname)
+            self._write({'d': dirname})
+
+    def checkpoint(self):
+        """Make everything written so far durable."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        self._close_file()
+        self._unlock()
+
+    def finish(self):
+        """The run completed, there is nothing left to resume."""
+        self._close_file()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._unlock()
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        self.checkpoint()
+        self._file.close()
+        self._file = None
+
+    def _unlock(self):
+        if self._lock_file is None:
+            return
+        # Closing the file releases the lock.
+        self._lock_file.close()
+        self._lock_file = None
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.checkpoint()
+
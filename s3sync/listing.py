@@ -0,0 +1,204 @@
+from collections import deque
+import Queue
+import sys
+import threading
+
+from boto.s3.bucketlistresultset import bucket_lister
+from boto.s3.prefix import Prefix
+
+from s3sync.utils import get_s3_connection
+
+
+class _Failure(object):
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+_DONE = object()
+
+
+def _start_workers(bucket, tasks, handle, fail, count, name, stop):
+    """Start count threads taking tasks off the queue until it is empty or
+    stop is set.
+
+    Each thread calls handle(worker_bucket, task) for its tasks, or
+    fail(task, exc_info) if that raised. boto connections are not thread
+    safe, so each thread gets its own connection to the bucket.
+    """
+    def work():
+        worker_bucket = None
+        while not stop.is_set():
+            try:
+                task = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                if worker_bucket is None:
+                    worker_bucket = get_s3_connection().get_bucket(
+                        bucket.name, validate=False)
+                handle(worker_bucket, task)
+            except Exception:
+                fail(task, sys.exc_info())
+
+    threads = []
+    for i in range(count):
+        worker = threading.Thread(target=work, name='%s-%d' % (name, i))
+        worker.daemon = True
+        worker.start()
+        threads.append(worker)
+    return threads
+
+
+def _stop_workers(threads, stop):
+    stop.set()
+    for worker in threads:
+        worker.join()
+
+
+def find_partitions(bucket, prefix='', count=32, delimiter='/',
+                    max_keys=1000):
+    """Split the keys under prefix into disjoint prefixes using delimiter
+    listings, paging through each to find all of its common prefixes.
+
+    Returns the sorted partition prefixes and the keys found on the way.
+    Prefixes holding more than max_keys keys directly are kept whole, it's
+    quicker to have a worker list them than to page through them here.
+    """
+    partitions = set([prefix])
+    keys = []
+    to_split = deque([prefix])
+    while to_split and len(partitions) < count:
+        partition = to_split.popleft()
+        found_prefixes = []
+        found_keys = []
+        for item in bucket_lister(bucket, prefix=partition,
+                                  delimiter=delimiter):
+            if isinstance(item, Prefix):
+                found_prefixes.append(item.name)
+            else:
+                found_keys.append(item)
+                if len(found_keys) > max_keys:
+                    break
+        else:
+            partitions.remove(partition)
+            partitions.update(found_prefixes)
+            to_split.extend(found_prefixes)
+            keys.extend(found_keys)
+    return sorted(partitions), keys
+
+
+def parallel_bucket_lister(bucket, prefix='', marker='', workers=8,
+                           delimiter='/', page_size=1000, pages_ahead=4):
+    """Like boto's bucket_lister, but lists partitions of the bucket from
+    several threads at once.
+
+    Keys are yielded in the same sorted order as bucket_lister, starting
+    after marker if given. Each worker reads at most pages_ahead pages ahead
+    of the consumer.
+    """
+    if workers <= 1:
+        for key in bucket_lister(bucket, prefix=prefix, marker=marker):
+            yield key
+        return
+
+    partitions, keys = find_partitions(bucket, prefix, count=workers * 4,
+                                       delimiter=delimiter, max_keys=page_size)
+    if marker:
+        # Drop whatever sorts before the marker. Keys in a partition all
+        # sort before the marker if the partition does and isn't its prefix.
+        keys = [key for key in keys if key.name > marker]
+        partitions = [partition for partition in partitions
+                      if partition > marker or marker.startswith(partition)]
+    # Partitions are disjoint key ranges, so sorting them with the loose
+    # keys by name and listing each in turn keeps the whole stream sorted.
+    entries = [(key.name, key, None) for key in keys]
+    entries.extend([(partition, None, i)
+                    for i, partition in enumerate(partitions)])
+    entries.sort()
+
+    tasks = Queue.Queue()
+    outputs = []
+    for i, partition in enumerate(partitions):
+        tasks.put((i, partition))
+        outputs.append(Queue.Queue(pages_ahead))
+    stop = threading.Event()
+
+    def put(output, item):
+        while not stop.is_set():
+            try:
+                output.put(item, timeout=0.5)
+            except Queue.Full:
+                continue
+            return True
+        return False
+
+    def list_partition(worker_bucket, task):
+        i, partition = task
+        page = []
+        partition_marker = ''
+        if marker.startswith(partition):
+            partition_marker = marker
+        for key in bucket_lister(worker_bucket, prefix=partition,
+                                 marker=partition_marker):
+            page.append(key)
+            if len(page) >= page_size:
+                if not put(outputs[i], page):
+                    return
+                page = []
+        if put(outputs[i], page):
+            put(outputs[i], _DONE)
+
+    def fail(task, exc_info):
+        put(outputs[task[0]], _Failure(exc_info))
+
+    threads = _start_workers(bucket, tasks, list_partition, fail,
+                             min(workers, len(partitions)), 's3sync-lister',
+                             stop)
+
+    try:
+        for name, key, i in entries:
+            if key is not None:
+                yield key
+                continue
+            while True:
+                page = outputs[i].get()
+                if page is _DONE:
+                    break
+                if isinstance(page, _Failure):
+                    raise page.exc_info[0], page.exc_info[1], \
+                        page.exc_info[2]
+                for page_key in page:
+                    yield page_key
+    finally:
+        _stop_workers(threads, stop)
+
+
+def parallel_head(bucket, names, workers=8):
+    """Fetch the keys with the given names from several threads at once,
+    one HEAD request each.
+
+    Yields (name, key) pairs as they complete, key is None for names
+    missing from the bucket.
+    """
+    tasks = Queue.Queue()
+    for name in names:
+        tasks.put(name)
+    results = Queue.Queue()
+    stop = threading.Event()
+
+    def head(worker_bucket, name):
+        results.put((name, worker_bucket.get_key(name)))
+
+    def fail(name, exc_info):
+        results.put((name, _Failure(exc_info)))
+
+    threads = _start_workers(bucket, tasks, head, fail,
+                             min(workers, len(names)), 's3sync-head', stop)
+    try:
+        for i in range(len(names)):
+            name, key = results.get()
+            if isinstance(key, _Failure):
+                raise key.exc_info[0], key.exc_info[1], key.exc_info[2]
+            yield name, key
+    finally:
+        _stop_workers(threads, stop)
@@ -0,0 +1,377 @@
+"""
+Audit Media on S3
+=================
+
+Django command that checks your local files against the upload bucket and
+reports the ones that are missing on S3 or differ in size or ETag (MD5).
+Useful to catch files that dropped out of the pending queue, e.g. because
+the cache evicted it or an upload failed. Optionally queues them for
+upload again.
+
+Big buckets can be audited a slice at a time: check a key range with
+--after/--before, a few files per run with --limit (each run continues
+where the last one stopped), or random files with --sample.
+
+Files that are gzipped on upload can only be checked for existence, their
+size and ETag on S3 are those of the compressed data.
+
+Note: This script requires the Python boto library and valid Amazon Web
+Services API keys.
+
+Required settings.py variables:
+AWS_ACCESS_KEY_ID = ''
+AWS_SECRET_ACCESS_KEY = ''
+BUCKET_UPLOADS = 'bucket-name.yourdomain.com'
+
+Command options are:
+  -b BUCKET, --bucket=BUCKET
+                        The name of the Amazon bucket to check, instead of
+                        BUCKET_UPLOADS.
+  -p PREFIX, --prefix=PREFIX
+                        The prefix to prepend to the path on S3.
+  -d DIRECTORY, --dir=DIRECTORY
+                        The root directory to use instead of your MEDIA_ROOT
+  --subdir=PATH         Only check the files under this directory of
+                        DIRECTORY, e.g. uploads. Paths on S3 stay relative
+                        to DIRECTORY.
+  --exclude-list        Directory and file exclusion filters. (enter as
+                        comma separated line)
+  --no-gzip             Files were uploaded without gzip, check the size and
+                        ETag of CSS and Javascript files too.
+  --after=KEY           Only check files sorting after this path.
+  --before=KEY          Only check files sorting before this path.
+  --limit=N             Check at most N files, and continue after the last
+                        one on the next run.
+  --sample=N            Check N random files with HEAD requests instead of
+                        listing the bucket.
+  --workers=N           Threads listing the bucket or sending HEAD requests
+                        (default 4).
+  --enqueue             Queue missing and differing files for upload by
+                        s3sync_pending.
+
+"""
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+from fnmatch import fnmatch
+import optparse
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import boto
+
+from s3sync.listing import parallel_bucket_lister, parallel_head
+from s3sync.storage import cache
+from s3sync.utils import (ConfigMissingError, get_aws_info, get_pending_key,
+    get_s3_connection, guess_mimetype, pending_lock, should_gzip)
+
+
+class Command(BaseCommand):
+    # Extra variables to avoid passing these around
+    EXCLUDE_LIST = []
+
+    check_count = 0
+    missing_count = 0
+    mismatch_count = 0
+    enqueue_count = 0
+
+    option_list = BaseCommand.option_list + (
+        optparse.make_option('-b', '--bucket',
+            dest='bucket', default='',
+            help="The name of the Amazon bucket to check."),
+        optparse.make_option('-p', '--prefix',
+            dest='prefix',
+            default='',
+            help="The prefix to prepend to the path on S3."),
+        optparse.make_option('-d', '--dir',
+            dest='dir',
+            default='',
+            help="The root directory to use instead of your MEDIA_ROOT"),
+        optparse.make_option('--subdir', dest='subdir',
+            default='',
+            help="Only check the files under this directory of --dir."),
+        optparse.make_option('--exclude-list', dest='exclude_list',
+            action='store', default='',
+            help="Directory and file exclusion filters. "
+                 "(enter as comma separated line)"),
+        optparse.make_option('--no-gzip',
+            action='store_false', dest='gzip', default=True,
+            help="Files were uploaded without gzip."),
+        optparse.make_option('--after', dest='after',
+            action='store', default='',
+            help="Only check files sorting after this path."),
+        optparse.make_option('--before', dest='before',
+            action='store', default='',
+            help="Only check files sorting before this path."),
+        optparse.make_option('--limit', dest='limit',
+            action='store', default=0,
+            help="Check at most N files, continue there on the next run."),
+        optparse.make_option('--sample', dest='sample',
+            action='store', default=0,
+            help="Check N random files with HEAD requests."),
+        optparse.make_option('--workers', dest='workers',
+            action='store', default=4,
+            help="Threads listing the bucket or sending HEAD requests."),
+        optparse.make_option('--enqueue',
+            action='store_true', dest='enqueue', default=False,
+            help="Queue missing and differing files for upload."),
+    )
+
+    help = 'Checks local files against the upload bucket.'
+
+    def handle(self, *args, **options):
+        # Check for AWS keys in settings
+        try:
+            get_aws_info()
+        except ConfigMissingError:
+            raise CommandError('Missing AWS keys from settings file. ' +
+                ' Please supply both AWS_ACCESS_KEY_ID and ' +
+                'AWS_SECRET_ACCESS_KEY.')
+
+        self.DIRECTORY = options.get('dir')
+        if not self.DIRECTORY:
+            self.DIRECTORY = getattr(settings, 'MEDIA_ROOT', '')
+        if not self.DIRECTORY:
+            raise CommandError('Empty directory. Define MEDIA_ROOT or use '
+                ' --dir=dirname')
+
+        # Keys stay relative to DIRECTORY, like s3sync_pending's.
+        self.subdir = options.get('subdir').strip('/')
+        if self.subdir:
+            if not os.path.isdir(os.path.join(self.DIRECTORY, self.subdir)):
+                raise CommandError('%s is not a directory in %s' % (
+                    self.subdir, self.DIRECTORY))
+            self.subdir += '/'
+
+        bucket_name = options.get('bucket')
+        if not bucket_name:
+            bucket_name = getattr(settings, 'BUCKET_UPLOADS', '')
+        if not bucket_name:
+            raise CommandError('Please specify the name of your upload bucket.'
+                ' Set BUCKET_UPLOADS in your settings.py or use --bucket')
+
+        self.verbosity = int(options.get('verbosity'))
+        self.prefix = options.get('prefix')
+        self.do_gzip = options.get('gzip')
+        self.after = options.get('after')
+        self.before = options.get('before')
+        self.limit = int(options.get('limit'))
+        self.sample = int(options.get('sample'))
+        self.workers = int(options.get('workers'))
+        self.enqueue = options.get('enqueue')
+        exclude_list = options.get('exclude_list')
+        if exclude_list and isinstance(exclude_list, list):
+            self.EXCLUDE_LIST = exclude_list
+        elif exclude_list:
+            self.EXCLUDE_LIST = exclude_list.split(',')
+
+        # Only reads, don't create the bucket like the sync commands do.
+        try:
+            self.bucket = get_s3_connection().get_bucket(bucket_name)
+        except boto.exception.S3ResponseError, e:
+            raise CommandError('Cannot access bucket %s: %s' % (
+                bucket_name, e))
+        # Files waiting for upload are expected to be missing.
+        self.pending = set(cache.get(get_pending_key(), []))
+        self.mismatched = []
+
+        if self.sample:
+            self.audit_sample()
+        else:
+            self.audit_range()
+        if self.enqueue:
+            self.enqueue_mismatched()
+
+        print
+        print "%d files checked." % self.check_count
+        print "%d files missing on S3." % self.missing_count
+        print "%d files differ on S3." % self.mismatch_count
+        if self.enqueue:
+            print "%d files queued for upload." % self.enqueue_count
+
+    def get_cursor_key(self):
+        run_hash = md5('%s|%s|%s|%s' % (self.bucket.name, self.prefix,
+                                        os.path.abspath(self.DIRECTORY),
+                                        self.subdir))
+        return '%s-audit-%s' % (get_pending_key(), run_hash.hexdigest()[:12])
+
+    def s3_name(self, file_key):
+        if self.prefix:
+            return '%s/%s' % (self.prefix, file_key)
+        return file_key
+
+    def local_files(self, dirname, after, before):
+        """
+        Yields the paths of local files relative to DIRECTORY, in the same
+        order S3 lists keys, between after and before
+        """
+        path = os.path.join(self.DIRECTORY, dirname)
+        try:
+            names = os.listdir(path)
+        except os.error:
+            return
+        entries = []
+        for name in names:
+            if [p for p in self.EXCLUDE_LIST if fnmatch(name, p)]:
+                continue
+            filename = os.path.join(path, name)
+            if os.path.isdir(filename):
+                if not os.path.islink(filename):
+                    entries.append((dirname + name + '/', True))
+            else:
+                entries.append((dirname + name, False))
+        # Everything in a directory sorts right after its path plus a slash,
+        # so walking entries sorted that way yields sorted paths.
+        entries.sort()
+        for file_key, is_dir in entries:
+            if before and file_key >= before:
+                return
+            if is_dir:
+                if after and file_key < after and \
+                    not after.startswith(file_key):
+                    continue  # all of it sorts before after
+                for sub_key in self.local_files(file_key, after, before):
+                    yield sub_key
+            elif not after or file_key > after:
+                if file_key not in self.pending:
+                    yield file_key
+
+    def audit_range(self):
+        """Merge the sorted local files with a listing of the bucket."""
+        after = self.after
+        cursor_key = self.get_cursor_key()
+        if self.limit:
+            cursor = cache.get(cursor_key)
+            if cursor and cursor > after and \
+                (not self.before or cursor < self.before):
+                after = cursor
+                if self.verbosity > 1:
+                    print "Continuing after %s" % cursor
+
+        list_prefix = self.s3_name(self.subdir)
+        s3_list = parallel_bucket_lister(self.bucket, prefix=list_prefix,
+            marker=after and self.s3_name(after), workers=self.workers)
+        s3_key = None
+        s3_name = None
+        last_checked = None
+        for file_key in self.local_files(self.subdir, after, self.before):
+            if self.limit and self.check_count >= self.limit:
+                break
+            name = self.s3_name(file_key)
+            # Skip keys with no local file, that's --remove-missing's job.
+            while s3_list is not None and (s3_name is None or s3_name < name):
+                try:
+                    s3_key = s3_list.next()
+                except StopIteration:
+                    s3_list = None
+                    s3_key = None
+                    s3_name = None
+                else:
+                    s3_name = s3_key.name.encode('utf-8')
+            if s3_name == name:
+                self.check(file_key, s3_key)
+            else:
+                self.check(file_key, None)
+            last_checked = file_key
+        else:
+            # Got to the end, start over next time.
+            last_checked = None
+        if s3_list is not None:
+            s3_list.close()
+
+        if self.limit:
+            if last_checked:
+                cache.set(cursor_key, last_checked)
+            else:
+                cache.delete(cursor_key)
+
+    def audit_sample(self):
+        """HEAD a random sample of the local files."""
+        sample = []
+        # Reservoir sampling, no need to keep every path around.
+        for i, file_key in enumerate(self.local_files(self.subdir, self.after,
+                                                      self.before)):
+            if i < self.sample:
+                sample.append(file_key)
+            else:
+                j = random.randint(0, i)
+                if j < self.sample:
+                    sample[j] = file_key
+        names = dict((self.s3_name(file_key), file_key)
+                     for file_key in sample)
+        for name, s3_key in parallel_head(self.bucket, names.keys(),
+                                          workers=self.workers):
+            self.check(names[name], s3_key)
+
+    def check(self, file_key, s3_key):
+        """Compare a local file with its key on S3, None if missing."""
+        self.check_count += 1
+        if s3_key is None:
+            print "Missing on S3: %s" % file_key
+            self.missing_count += 1
+            self.mismatched.append(file_key)
+            return
+
+        filename = os.path.join(self.DIRECTORY, file_key)
+        try:
+            file_size = os.path.getsize(filename)
+        except os.error:
+            # Deleted since it was listed.
+            return
+        if self.do_gzip and should_gzip(guess_mimetype(filename), file_size):
+            # Compressed on S3, its existence is all we can check.
+            return
+        if int(s3_key.size) != file_size:
+            print "Size differs on S3: %s (%s bytes, %s on S3)" % (
+                file_key, file_size, s3_key.size)
+            self.mismatch_count += 1
+            self.mismatched.append(file_key)
+            return
+        etag = s3_key.etag.strip('"')
+        # Multipart uploads don't have an MD5 ETag.
+        if '-' in etag:
+            return
+        try:
+            local_md5 = file_md5(filename)
+        except (os.error, IOError):
+            return
+        if local_md5 != etag:
+            print "ETag differs on S3: %s" % file_key
+            self.mismatch_count += 1
+            self.mismatched.append(file_key)
+            return
+        if self.verbosity > 1:
+            print "OK: %s" % file_key
+
+    def enqueue_mismatched(self):
+        """Queue the bad files like S3PendingStorage does for new files."""
+        if not self.mismatched:
+            return
+        pending_key = get_pending_key()
+        with pending_lock(cache):
+            pending = cache.get(pending_key, [])
+            for file_key in self.mismatched:
+                if file_key in pending:
+                    continue
+                cache.set(file_key, time.time())
+                pending.append(file_key)
+                self.enqueue_count += 1
+            cache.set(pending_key, pending)
+
+
+def file_md5(filename, chunk_size=64 * 1024):
+    file_obj = open(filename, 'rb')
+    try:
+        file_hash = md5()
+        chunk = file_obj.read(chunk_size)
+        while chunk:
+            file_hash.update(chunk)
+            chunk = file_obj.read(chunk_size)
+    finally:
+        file_obj.close()
+    return file_hash.hexdigest()
@@ -35,6 +35,27 @@ Command options are:
                         filters. (enter as comma separated line)
   --dry-run
                         Do A dry-run to show what files would be affected.
+  --job=NAME            Sync every target of a job defined in
+                        settings.BUCKET_SYNC_JOBS, walking overlapping
+                        directories once and sharing the S3 connection.
+                        Options of a single target, like --bucket or
+                        --remove-missing, are set in the job instead.
+  --list-workers=N      Threads used to list the bucket for --remove-missing
+                        (default 8).
+  --state=FILE          Remember directory mtimes between runs in FILE and
+                        skip directories that haven't changed.
+  --deep-scan-every=HOURS
+                        Skip unchanged directories like --state, but check
+                        every file again after this many hours (default 24
+                        with --state). The state file defaults to one in the
+                        temp directory named after the synced targets.
+  --resume              Continue an interrupted run from its journal, skipping
+                        directories and files it already synced.
+  --journal=FILE        Where to keep the progress journal. Defaults to a
+                        file in the temp directory named after the bucket,
+                        prefix and directory. Use a persistent path to
+                        resume after a reboot or deploy.
+  --checkpoint-every=N  Fsync the journal every N entries (default 100).
 
 """
 import datetime
@@ -43,15 +64,20 @@ try:
     from hashlib import md5
 except ImportError:
     from md5 import md5
+import json
 import optparse
 import os
+import tempfile
 import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
+from s3sync.dirstate import DirectoryState
+from s3sync.journal import JournalLockedError, SyncJournal
+from s3sync.listing import parallel_bucket_lister
 from s3sync.utils import (get_aws_info, get_bucket_and_key, ConfigMissingError,
-    upload_file_to_s3)
+    get_s3_connection, upload_file_to_s3)
 
 # Make sure boto is available
 try:
@@ -62,17 +88,77 @@ except ImportError:
     raise ImportError("The boto Python library is not installed.")
 
 
+class SyncTarget(object):
+    """A local directory synced to a bucket/prefix, and its progress."""
+
+    def __init__(self, bucket, dir, prefix='', exclude_list=None, gzip=False,
+                 expires=False, remove_missing=False, journal=''):
+        self.bucket_name = bucket
+        self.directory = os.path.abspath(dir)
+        # Later we assume the root ends with a trailing slash
+        self.root_dir = os.path.join(self.directory, '')
+        self.prefix = prefix
+        if exclude_list and isinstance(exclude_list, list):
+            self.exclude_list = exclude_list
+        elif exclude_list:
+            self.exclude_list = exclude_list.split(',')
+        else:
+            self.exclude_list = []
+        self.do_gzip = gzip
+        self.do_expires = expires
+        self.remove_missing = remove_missing
+        self.journal_path = journal
+
+        self.bucket = None
+        self.key = None
+        self.journal = None
+        self.root_list = None
+        self.changed = False
+        self.s3_files = {}
+        self.files_processed = set()
+        self.pruned = set()
+
+        self.upload_count = 0
+        self.skip_count = 0
+        self.resume_count = 0
+        self.remove_bucket_count = 0
+
+    def __str__(self):
+        return '%s -> %s/%s' % (self.directory, self.bucket_name, self.prefix)
+
+    def contains(self, dirname):
+        """Whether dirname is in this target's tree and not excluded."""
+        if dirname != self.directory and \
+            not dirname.startswith(self.root_dir):
+            return False
+        for pruned in self.pruned:
+            if dirname == pruned or \
+                dirname.startswith(os.path.join(pruned, '')):
+                return False
+        return True
+
+    def excluded(self, name):
+        """Return the exclusion filter matching name, if any."""
+        for pattern in self.exclude_list:
+            if fnmatch(name, pattern):
+                return pattern
+        return None
+
+    def file_key(self, filename):
+        file_key = filename[len(self.root_dir):]
+        if self.prefix:
+            file_key = '%s/%s' % (self.prefix, file_key)
+        return file_key
+
+
 class Command(BaseCommand):
     # Extra variables to avoid passing these around
     AWS_ACCESS_KEY_ID = ''
     AWS_SECRET_ACCESS_KEY = ''
-    AWS_BUCKET_NAME = ''
-    DIRECTORY = ''
-    EXCLUDE_LIST = []
-
-    upload_count = 0
-    skip_count = 0
-    remove_bucket_count = 0
+    targets = []
+    # Set per target in BUCKET_SYNC_JOBS when using --job.
+    target_options = ('bucket', 'prefix', 'dir', 'exclude_list', 'gzip',
+                      'expires', 'remove_missing', 'journal')
 
     option_list = BaseCommand.option_list + (
         optparse.make_option('-b', '--bucket',
@@ -104,6 +190,29 @@ class Command(BaseCommand):
             action='store', default='',
             help="Override default directory and file exclusion filters. "
                  "(enter as comma separated line)"),
+        optparse.make_option('--job', dest='job',
+            action='store', default='',
+            help="Sync all targets of a job from settings.BUCKET_SYNC_JOBS "
+                 "in a single walk."),
+        optparse.make_option('--list-workers', dest='list_workers',
+            action='store', default=8,
+            help="Threads used to list the bucket for --remove-missing."),
+        optparse.make_option('--state', dest='state',
+            action='store', default='',
+            help="Path of the file remembering directory mtimes."),
+        optparse.make_option('--deep-scan-every', dest='deep_scan_every',
+            action='store', default='',
+            help="Skip unchanged directories, but check every file again "
+                 "after this many hours."),
+        optparse.make_option('--resume',
+            action='store_true', dest='resume', default=False,
+            help="Continue an interrupted run from its journal."),
+        optparse.make_option('--journal', dest='journal',
+            action='store', default='',
+            help="Path of the progress journal used by --resume."),
+        optparse.make_option('--checkpoint-every', dest='checkpoint_every',
+            action='store', default=100,
+            help="Fsync the progress journal every N entries."),
         # TODO: implement
         optparse.make_option('--hash-chunk-size', dest='hash_chunk',
             action='store', default=4096,
@@ -125,10 +234,6 @@ class Command(BaseCommand):
 
         self.AWS_ACCESS_KEY_ID = settings.AWS_ACCESS_KEY_ID
         self.AWS_SECRET_ACCESS_KEY = settings.AWS_SECRET_ACCESS_KEY
-        self.AWS_BUCKET_NAME = options.get('bucket')
-
-        if not self.AWS_BUCKET_NAME:
-            raise CommandError('No bucket specified. Use --bucket=name')
 
         if not settings.MEDIA_ROOT:
             raise CommandError('MEDIA_ROOT must be set in your settings.')
@@ -136,159 +241,373 @@ class Command(BaseCommand):
         self.verbosity = int(options.get('verbosity'))
         # TODO: compare first hash chunk of files to see if they're identical
         self.hash_chunk = int(options.get('hash_chunk'))
-        self.prefix = options.get('prefix')
-        self.do_gzip = options.get('gzip')
-        self.do_expires = options.get('expires')
         self.do_force = options.get('force')
-        self.remove_missing = options.get('remove_missing')
         self.dry_run = options.get('dry_run')
-        self.DIRECTORY = options.get('dir')
-        exclude_list = options.get('exclude_list')
-        if exclude_list and isinstance(exclude_list, list):
-            # command line option overrides default exclude_list
-            self.EXCLUDE_LIST = exclude_list
-        elif exclude_list:
-            self.EXCLUDE_LIST = exclude_list.split(',')
+        self.resume = options.get('resume')
+        self.checkpoint_every = int(options.get('checkpoint_every'))
+        self.list_workers = int(options.get('list_workers'))
+        self.state_path = options.get('state')
+        # Skipping unchanged directories misses files edited in place until
+        # the next deep scan, so it's only done when asked for.
+        deep_scan_every = options.get('deep_scan_every')
+        self.use_state = bool(self.state_path or deep_scan_every != '')
+        if deep_scan_every == '':
+            deep_scan_every = 24
+        self.deep_scan_every = float(deep_scan_every)
+
+        job = options.get('job')
+        if job:
+            given = [option.get_opt_string() for option in self.option_list
+                     if option.dest in self.target_options and
+                     options.get(option.dest, option.default) !=
+                     option.default]
+            if given:
+                raise CommandError('%s cannot be used with --job, set them '
+                    'per target in BUCKET_SYNC_JOBS instead.' %
+                    ', '.join(given))
+            self.targets = self.get_job_targets(job)
+        else:
+            if not options.get('bucket'):
+                raise CommandError('No bucket specified. Use --bucket=name')
+            self.targets = [SyncTarget(options.get('bucket'),
+                options.get('dir'),
+                prefix=options.get('prefix'),
+                exclude_list=options.get('exclude_list'),
+                gzip=options.get('gzip'),
+                expires=options.get('expires'),
+                remove_missing=options.get('remove_missing'),
+                journal=options.get('journal'))]
 
         # Now call the syncing method to walk the MEDIA_ROOT directory and
         # upload all files found.
         self.sync_s3()
 
-        print
-        print "%d files uploaded." % (self.upload_count)
-        print "%d files skipped." % (self.skip_count)
-        if self.remove_missing:
-            print "%d keys removed from bucket." % (self.remove_bucket_count)
+        for target in self.targets:
+            print
+            if len(self.targets) > 1:
+                print "%s:" % target
+            print "%d files uploaded." % (target.upload_count)
+            print "%d files skipped." % (target.skip_count)
+            if self.resume:
+                print "%d files already synced before resuming." % (
+                    target.resume_count)
+            if target.remove_missing:
+                print "%d keys removed from bucket." % (
+                    target.remove_bucket_count)
         if self.dry_run:
             print 'THIS IS A DRY RUN, NO ACTUAL CHANGES.'
 
+    def get_job_targets(self, job):
+        """Build the targets of a job defined in settings.BUCKET_SYNC_JOBS."""
+        jobs = getattr(settings, 'BUCKET_SYNC_JOBS', {})
+        if job not in jobs:
+            raise CommandError('Unknown job %s. Define it in '
+                'BUCKET_SYNC_JOBS in your settings.py' % job)
+        targets = []
+        for spec in jobs[job]:
+            if not spec.get('bucket'):
+                raise CommandError('Every target of job %s needs a bucket.'
+                                   % job)
+            targets.append(SyncTarget(spec['bucket'],
+                spec.get('dir', settings.MEDIA_ROOT),
+                prefix=spec.get('prefix', ''),
+                exclude_list=spec.get('exclude_list'),
+                gzip=spec.get('gzip', False),
+                expires=spec.get('expires', False),
+                remove_missing=spec.get('remove_missing', False),
+                journal=spec.get('journal', '')))
+        return targets
+
     def sync_s3(self):
         """
-        Walks the media directory and syncs files to S3
+        Walks the media directories once and syncs files to all targets
         """
-        bucket, key = get_bucket_and_key(self.AWS_BUCKET_NAME)
-        self.s3_files = {}
-        self.files_processed = set()
-        os.path.walk(self.DIRECTORY, self.upload_s3,
-            (bucket, key, self.AWS_BUCKET_NAME, self.DIRECTORY))
-
-        # Remove files on bucket if they're missing locally
-        if self.remove_missing:
-            self.remove_s3(bucket)
-
-    def find_key_in_list(self, s3_list, file_key):
-        if file_key in self.s3_files:
-            return self.s3_files[file_key]
+        conn = get_s3_connection()
+        buckets = {}
+        for target in self.targets:
+            if target.bucket_name not in buckets:
+                buckets[target.bucket_name] = get_bucket_and_key(
+                    target.bucket_name, conn=conn)
+            target.bucket, target.key = buckets[target.bucket_name]
+            if not self.dry_run:
+                self.open_journal(target)
+
+        self.open_state()
+
+        # Walk overlapping trees only once, from their topmost directory.
+        roots = []
+        for directory in sorted(set(t.directory for t in self.targets)):
+            if not [root for root in roots
+                    if directory.startswith(os.path.join(root, ''))]:
+                roots.append(directory)
+        for root in roots:
+            self.walk(root)
+
+        for target in self.targets:
+            # Remove files on bucket if they're missing locally
+            if target.remove_missing and target.changed:
+                if target.root_list is not None:
+                    self.finish_list(target, target.root_list)
+                self.remove_s3(target)
+            elif target.remove_missing and self.verbosity > 0:
+                print
+                print 'Nothing changed in %s, no files to remove.' % (
+                    target.directory)
+            if target.journal:
+                target.journal.finish()
+
+        if self.dir_state is not None and not self.dry_run:
+            self.dir_state.save(deep_scan=self.deep_scan)
+
+    def open_state(self):
+        """Load directory mtimes from the last run, unless it's time for a
+        deep scan or skipping unchanged directories wasn't asked for."""
+        if not self.use_state:
+            self.dir_state = None
+            self.deep_scan = True
+            return
+        params = [{'bucket': t.bucket_name, 'prefix': t.prefix,
+                   'dir': t.directory, 'exclude_list': t.exclude_list,
+                   'gzip': bool(t.do_gzip), 'expires': bool(t.do_expires),
+                   'remove_missing': bool(t.remove_missing)}
+                  for t in self.targets]
+        path = self.state_path
+        if not path:
+            run_hash = md5(json.dumps(params, sort_keys=True))
+            path = os.path.join(tempfile.gettempdir(),
+                's3sync-media-%s.state' % run_hash.hexdigest()[:12])
+        self.dir_state = DirectoryState(path, params)
+        loaded = self.dir_state.load()
+        self.deep_scan = (self.do_force or not loaded or
+            time.time() - self.dir_state.deep_scan >
+                self.deep_scan_every * 3600)
+        if self.deep_scan and self.verbosity > 1:
+            print 'Checking every file.'
+
+    def walk(self, dirname):
+        """
+        Walks a directory tree like os.path.walk, calling sync_dir for each
+        directory, without stat'ing the entries of unchanged directories
+        """
+        try:
+            mtime = os.stat(dirname).st_mtime
+            names = os.listdir(dirname)
+        except os.error:
+            return
+        subdirs = None
+        if not self.deep_scan:
+            subdirs = self.dir_state.unchanged(dirname, mtime, len(names))
+        unchanged = subdirs is not None
+        if not unchanged:
+            subdirs = [name for name in names
+                       if os.path.isdir(os.path.join(dirname, name))]
+        # Don't try to upload directories
+        dir_names = set(subdirs)
+        files = [name for name in names if name not in dir_names]
+
+        descend, synced = self.sync_dir(dirname, files, unchanged)
+        if synced and self.dir_state is not None:
+            self.dir_state.record(dirname, mtime, len(names), subdirs)
+        if not descend:
+            return
+        for name in subdirs:
+            path = os.path.join(dirname, name)
+            if not os.path.islink(path):
+                self.walk(path)
+
+    def open_journal(self, target):
+        """Set up the progress journal, loading it if resuming."""
+        params = {'bucket': target.bucket_name, 'prefix': target.prefix,
+                  'dir': target.directory}
+        path = target.journal_path
+        if not path:
+            run_hash = md5('%(bucket)s|%(prefix)s|%(dir)s' % params)
+            path = os.path.join(tempfile.gettempdir(),
+                's3sync-media-%s.journal' % run_hash.hexdigest()[:12])
+        target.journal = SyncJournal(path, params,
+                                     sync_every=self.checkpoint_every)
+        try:
+            target.journal.lock()
+        except JournalLockedError:
+            raise CommandError('Another run is syncing %s to %s, its '
+                'journal %s is locked.' % (target.directory,
+                                           target.bucket_name, path))
+        resuming = self.resume and target.journal.load()
+        if self.resume:
+            if resuming:
+                print "Resuming from %s: %d directories and %d files done." % (
+                    path, len(target.journal.dirs), len(target.journal.keys))
+            else:
+                print "No journal to resume at %s, starting over." % path
+        target.journal.open(resume=resuming)
+
+    def mark_processed(self, target, file_key):
+        if file_key in target.s3_files:
+            del target.s3_files[file_key]
+        # Only needed to find what's missing, don't grow it otherwise.
+        if target.remove_missing:
+            target.files_processed.add(file_key)
+
+    def find_key_in_list(self, target, s3_list, file_key):
+        if file_key in target.s3_files:
+            return target.s3_files[file_key]
         for s3_key in s3_list:
             if s3_key.name == file_key:
                 return s3_key
-            if s3_key.name not in self.files_processed:
-                self.s3_files[s3_key.name] = s3_key
+            if s3_key.name not in target.files_processed:
+                target.s3_files[s3_key.name] = s3_key
         return None
 
-    def finish_list(self, s3_list):
+    def finish_list(self, target, s3_list):
         for s3_key in s3_list:
-            if s3_key.name not in self.files_processed:
-                self.s3_files[s3_key.name] = s3_key
+            if s3_key.name not in target.files_processed:
+                target.s3_files[s3_key.name] = s3_key
 
-    def remove_s3(self, bucket):
+    def remove_s3(self, target):
         print
-        if not self.s3_files:
+        if not target.s3_files:
             if self.verbosity > 0:
                 print 'No files to remove.'
             return
 
-        for key, value in self.s3_files.items():
+        for key, value in target.s3_files.items():
             if not self.dry_run:
-                bucket.delete_key(value.name)
-            self.remove_bucket_count += 1
+                target.bucket.delete_key(value.name)
+            target.remove_bucket_count += 1
             print "Deleting %s..." % (key)
 
-    def upload_s3(self, arg, dirname, names):
+    def sync_dir(self, dirname, files, unchanged=False):
         """
-        This is the callback to os.path.walk and where much of the work happens
+        Hands the directory to every target it belongs to. Returns whether
+        to walk its subdirectories, and whether it synced without failures
         """
-        bucket, key, bucket_name, root_dir = arg
-
-        # Skip files and directories we don't want to sync
-        for pattern in self.EXCLUDE_LIST:
-            if fnmatch(os.path.basename(dirname), pattern):
+        active = False
+        synced = True
+        for target in self.targets:
+            if not target.contains(dirname):
+                continue
+            # Skip directories we don't want to sync
+            pattern = target.excluded(os.path.basename(dirname))
+            if pattern:
                 if self.verbosity > 1:
-                    print 'Skipping: %s (rule: %s)' % (names, pattern)
-                del names[:]
-                return
+                    print 'Skipping: %s (rule: %s)' % (dirname, pattern)
+                target.pruned.add(dirname)
+                continue
+            active = True
+            if not self.upload_s3(target, dirname, files, unchanged):
+                synced = False
 
-        # Later we assume the MEDIA_ROOT ends with a trailing slash
-        if not root_dir.endswith(os.path.sep):
-            root_dir = root_dir + os.path.sep
+        # No target wants anything below here, stop walking.
+        descend = active or bool([t for t in self.targets
+                if t.directory.startswith(os.path.join(dirname, ''))])
+        return descend, synced
 
-        list_prefix = dirname[len(root_dir):]
-        if self.prefix:
-            list_prefix = '%s/%s' % (self.prefix, list_prefix)
-        s3_list = bucket_lister(bucket, prefix=list_prefix)
-
-        for name in names:
-            bad_name = False
-            for pattern in self.EXCLUDE_LIST:
-                if fnmatch(name, pattern):
-                    bad_name = True  # Skip files we don't want to sync
-            if bad_name:
+    def upload_s3(self, target, dirname, files, unchanged=False):
+        """
+        Syncs the files of one directory to a target, this is where much of
+        the work happens. Returns False if any upload failed
+        """
+        list_prefix = dirname[len(target.root_dir):]
+        if target.prefix:
+            list_prefix = '%s/%s' % (target.prefix, list_prefix)
+        is_root = dirname == target.directory
+        if is_root and target.remove_missing:
+            # The whole listing gets read to find what's missing locally,
+            # fetch it in parallel.
+            s3_list = parallel_bucket_lister(target.bucket,
+                prefix=list_prefix, workers=self.list_workers)
+        else:
+            s3_list = bucket_lister(target.bucket, prefix=list_prefix)
+
+        # Directory unchanged since the last run, or completed by the run
+        # we are resuming. Nothing to upload but its keys still count as
+        # present locally.
+        resumed = target.journal and target.journal.is_dir_done(dirname)
+        if not unchanged:
+            target.changed = True
+        if unchanged or resumed:
+            for name in files:
+                if target.excluded(name):
+                    continue
+                self.mark_processed(target,
+                    target.file_key(os.path.join(dirname, name)))
+                if unchanged:
+                    target.skip_count += 1
+                else:
+                    target.resume_count += 1
+            if is_root and target.remove_missing:
+                # Only read if something changed further down.
+                target.root_list = s3_list
+            return True
+
+        failed = False
+
+        for name in files:
+            pattern = target.excluded(name)
+            if pattern:
+                # Skip files we don't want to sync
                 if self.verbosity > 1:
-                    print 'Skipping: %s (rule: %s)' % (names, pattern)
+                    print 'Skipping: %s (rule: %s)' % (name, pattern)
                 continue
 
             filename = os.path.join(dirname, name)
-            if os.path.isdir(filename):
-                continue  # Don't try to upload directories
+            file_key = target.file_key(filename)
 
-            file_key = filename[len(root_dir):]
-            if self.prefix:
-                file_key = '%s/%s' % (self.prefix, file_key)
+            if target.journal and target.journal.is_key_done(file_key):
+                self.mark_processed(target, file_key)
+                target.resume_count += 1
+                continue
 
             # Check if file on S3 is older than local file, if so, upload
             # TODO: check if hash chunk corresponds
             if not self.do_force:
-                s3_key = self.find_key_in_list(s3_list, file_key)
+                s3_key = self.find_key_in_list(target, s3_list, file_key)
                 if s3_key:
                     s3_datetime = datetime.datetime(*time.strptime(
                         s3_key.last_modified, '%Y-%m-%dT%H:%M:%S.000Z')[0:6])
                     local_datetime = datetime.datetime.utcfromtimestamp(
                         os.stat(filename).st_mtime)
                     if local_datetime < s3_datetime:
-                        self.skip_count += 1
+                        target.skip_count += 1
                         if self.verbosity > 1:
                             print "File %s hasn't been modified since last " \
                                 "being uploaded" % (file_key)
-                        if file_key in self.s3_files:
-                            self.files_processed.add(file_key)
-                            del self.s3_files[file_key]
+                        self.mark_processed(target, file_key)
                         continue
-            if file_key in self.s3_files:
-                self.files_processed.add(file_key)
-                del self.s3_files[file_key]
+            self.mark_processed(target, file_key)
 
             # File is newer, let's process and upload
             if self.verbosity > 0:
                 print "Uploading %s..." % file_key
                 if self.dry_run:
-                    self.upload_count += 1
+                    target.upload_count += 1
                     continue
 
             try:
-                upload_file_to_s3(file_key, filename, key,
-                    do_gzip=self.do_gzip, do_expires=self.do_expires,
+                upload_file_to_s3(file_key, filename, target.key,
+                    do_gzip=target.do_gzip, do_expires=target.do_expires,
                     verbosity=self.verbosity)
             except boto.exception.S3CreateError, e:
                 # TODO: retry to create a few times
                 print "Failed to upload: %s" % e
+                failed = True
             except Exception, e:
                 print e
                 raise
             else:
-                self.upload_count += 1
+                target.upload_count += 1
+                if target.journal:
+                    target.journal.key_done(file_key)
+
+        # Only a directory without failures may be skipped when resuming.
+        if target.journal and not failed:
+            target.journal.dir_done(dirname)
 
         # If we don't care about what's missing, wipe this to save memory.
-        if not self.remove_missing:
-            self.s3_files = {}
-        else:
-            self.finish_list(s3_list)
+        if not target.remove_missing:
+            target.s3_files = {}
+        elif is_root:
+            # The root listing has every key, whatever the walk doesn't
+            # find is missing locally.
+            self.finish_list(target, s3_list)
+        return not failed
@@ -24,18 +24,23 @@ Command options are:
                         present in your local. DANGEROUS!
   --dry-run
                         Do a dry-run to show what files would be affected.
+  --stats
+                        Only show how many files are pending, how long the
+                        oldest has waited and how long uploads took.
 
 """
 import optparse
+import time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
 import boto
 
+from s3sync.stats import get_pending_stats, record_upload
 from s3sync.storage import cache
 from s3sync.utils import (ConfigMissingError, get_aws_info, get_bucket_and_key,
-    get_pending_key, get_pending_delete_key,
+    get_pending_key, get_pending_delete_key, pending_lock,
     upload_file_to_s3)
 
 
@@ -61,11 +66,18 @@ class Command(BaseCommand):
         optparse.make_option('--dry-run',
             action='store_true', dest='dry_run', default=False,
             help="Do a dry-run to show what files would be affected."),
+        optparse.make_option('--stats',
+            action='store_true', dest='stats', default=False,
+            help="Only show queue depth and upload latency."),
     )
 
     help = 'Uploads the pending files from cache key.'
 
     def handle(self, *args, **options):
+        if options.get('stats'):
+            self.print_stats()
+            return
+
         # Check for AWS keys in settings
         try:
             get_aws_info()
@@ -105,6 +117,27 @@ class Command(BaseCommand):
         if self.dry_run:
             print 'THIS IS A DRY RUN, NO ACTUAL CHANGES.'
 
+    def print_stats(self):
+        stats = get_pending_stats()
+        print "%d files pending upload." % stats['pending']
+        if stats['oldest_pending_age'] is not None:
+            print "Oldest pending file queued %d seconds ago." % (
+                stats['oldest_pending_age'])
+        print "%d files pending deletion." % stats['pending_delete']
+        if not stats['uploaded']:
+            return
+        print
+        print "Save to S3 latency of %d files uploaded since %s, " \
+            "%.1f seconds on average:" % (stats['uploaded'],
+                time.ctime(stats['uploaded_since']), stats['average_latency'])
+        previous = 0
+        for bound, count in stats['latency_histogram']:
+            if bound is None:
+                print "  over %6ds: %d" % (previous, count)
+            else:
+                print "  up to %5ds: %d" % (bound, count)
+            previous = bound
+
     def delete_pending_from_s3(self):
         """Gets the pending filenames from cache and deletes them."""
         pending_delete_key = get_pending_delete_key()
@@ -135,7 +168,8 @@ class Command(BaseCommand):
                     self.remaining_delete_count += 1
 
         if not self.dry_run:
-            cache.set(pending_delete_key, remaining)
+            self.remove_from_list(pending_delete_key,
+                                  set(pending) - set(remaining))
 
     def upload_pending_to_s3(self):
         """Gets the pending filenames from cache and uploads them."""
@@ -151,6 +185,7 @@ class Command(BaseCommand):
                 self.upload_count += 1
                 continue
             filename = self.DIRECTORY + '/' + file_key
+            enqueued = cache.get(file_key)
             failed = True
             try:
                 upload_file_to_s3(prefixed_file_key, filename, self.key,
@@ -164,6 +199,7 @@ class Command(BaseCommand):
             else:
                 failed = False
                 self.upload_count += 1
+                record_upload(enqueued)
                 cache.delete(file_key)
             finally:
                 if failed:
@@ -171,4 +207,10 @@ class Command(BaseCommand):
                     self.remaining_count += 1
 
         if not self.dry_run:
-            cache.set(pending_key, remaining)
+            self.remove_from_list(pending_key, set(pending) - set(remaining))
+
+    def remove_from_list(self, list_key, done):
+        """Drop the files we're done with, keeping any added meanwhile."""
+        with pending_lock(cache):
+            names = cache.get(list_key, [])
+            cache.set(list_key, [name for name in names if name not in done])
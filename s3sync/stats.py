@@ -0,0 +1,127 @@
+"""
+How far behind the pending uploads are.
+
+S3PendingStorage stores the time each file was queued as its pending cache
+value. Uploaders report how long each file waited, counted into a histogram
+of cache counters. get_pending_stats() is cheap enough to call from web
+processes, e.g. for a monitoring view.
+
+The counters cover the uploads since they were last reset. They are reset
+together, every BUCKET_UPLOADS_STATS_PERIOD seconds, so the histogram and
+the average latency always describe the same uploads.
+"""
+import time
+
+from django.conf import settings
+
+from s3sync.utils import (get_pending_key, get_pending_delete_key,
+    get_s3sync_cache)
+
+
+cache = get_s3sync_cache()
+
+# Upper bounds, in seconds, of the save to S3 latency histogram buckets.
+LATENCY_BUCKETS = (10, 60, 300, 900, 3600, 3600 * 6, 3600 * 24, None)
+
+STATS_PERIOD = getattr(settings, 'BUCKET_UPLOADS_STATS_PERIOD', 3600 * 24)
+
+
+def get_latency_key(bound):
+    return '%s-latency-%s' % (get_pending_key(), bound or 'inf')
+
+
+def get_latency_sum_key():
+    return '%s-latency-sum-ms' % get_pending_key()
+
+
+def get_latency_since_key():
+    return '%s-latency-since' % get_pending_key()
+
+
+def get_latency_keys():
+    return ([get_latency_key(bound) for bound in LATENCY_BUCKETS] +
+            [get_latency_sum_key()])
+
+
+def get_enqueued_time(value):
+    """Return the queue timestamp from a pending cache value, or None for
+    values without one (files queued before timestamps were stored)."""
+    if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+        return None
+    return value
+
+
+def record_upload(enqueued, now=None):
+    """Count a file reaching S3, given its pending cache value."""
+    enqueued = get_enqueued_time(enqueued)
+    if enqueued is None:
+        return
+    latency = max((now or time.time()) - enqueued, 0)
+    for bound in LATENCY_BUCKETS:
+        if bound is None or latency <= bound:
+            break
+    # Whoever starts a new period resets the counters. They are all set
+    # with the period's timeout, so they expire along with it.
+    if cache.add(get_latency_since_key(), time.time(), STATS_PERIOD):
+        reset_upload_stats()
+    _incr(get_latency_key(bound))
+    _incr(get_latency_sum_key(), int(latency * 1000))
+
+
+def reset_upload_stats():
+    """Start counting uploads from zero."""
+    cache.set(get_latency_since_key(), time.time(), STATS_PERIOD)
+    cache.set_many(dict((key, 0) for key in get_latency_keys()),
+                   STATS_PERIOD)
+
+
+def _incr(key, delta=1):
+    # add() doesn't overwrite, so concurrent uploaders don't lose counts.
+    cache.add(key, 0, STATS_PERIOD)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Evicted in between.
+        cache.set(key, delta, STATS_PERIOD)
+
+
+def get_pending_stats(sample=10):
+    """Queue depths, age of the oldest pending upload and the save to S3
+    latency histogram of the uploads since ``uploaded_since``.
+
+    Files are queued in order, so the oldest is looked for among the first
+    ``sample`` pending files only.
+    """
+    pending = cache.get(get_pending_key(), [])
+    deleting = cache.get(get_pending_delete_key(), [])
+    now = time.time()
+    oldest = None
+    if pending:
+        queued = cache.get_many(pending[:sample])
+        times = [get_enqueued_time(value) for value in queued.values()]
+        times = [t for t in times if t is not None]
+        if times:
+            oldest = max(now - min(times), 0)
+
+    latency_keys = [get_latency_key(bound) for bound in LATENCY_BUCKETS]
+    counts = cache.get_many(get_latency_keys() + [get_latency_since_key()])
+    since = counts.get(get_latency_since_key())
+    if since is None:
+        # The period is over, whatever is left belongs to it.
+        counts = {}
+    histogram = [(bound, counts.get(key, 0))
+                 for bound, key in zip(LATENCY_BUCKETS, latency_keys)]
+    uploaded = sum([count for bound, count in histogram])
+    average = None
+    if uploaded:
+        average = counts.get(get_latency_sum_key(), 0) / 1000.0 / uploaded
+
+    return {
+        'pending': len(pending),
+        'pending_delete': len(deleting),
+        'oldest_pending_age': oldest,
+        'uploaded': uploaded,
+        'uploaded_since': since,
+        'average_latency': average,
+        'latency_histogram': histogram,
+    }
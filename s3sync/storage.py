@@ -1,14 +1,25 @@
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+import os
+import time
+
 from django.conf import settings
 from django.core.files.storage import FileSystemStorage as DjangoStorage
+from django.utils.crypto import get_random_string
 
+from s3sync.uploader import get_background_uploader
 from s3sync.utils import (get_pending_key, get_pending_delete_key,
-    get_s3sync_cache)
+    get_s3sync_cache, pending_lock)
 
 
 deleting_key = get_pending_delete_key()
 pending_key = get_pending_key()
 cache = get_s3sync_cache()
 is_production = getattr(settings, 'PRODUCTION', False)
+reserve_names = getattr(settings, 'BUCKET_UPLOADS_RESERVE_NAMES', False)
+uploader = get_background_uploader()
 
 
 class S3PendingStorage(DjangoStorage):
@@ -20,28 +31,96 @@ class S3PendingStorage(DjangoStorage):
         super(S3PendingStorage, self).delete(name)
         if not is_production:
             return
-        deleting = cache.get(deleting_key, [])
-        pending = cache.get(pending_key, [])
-        # File was pending? Ok, remove it from upload queue.
-        if name in pending:
-            cache.delete(name)
-            del pending[pending.index(name)]
-        else:  # otherwise, mark it for deletion
-            deleting.append(name)
-        cache.set(deleting_key, deleting)
-        cache.set(pending_key, pending)
-
-    def save(self, name, content):
-        new_name = super(S3PendingStorage, self).save(name, content)
+        with pending_lock(cache):
+            deleting = cache.get(deleting_key, [])
+            pending = cache.get(pending_key, [])
+            # File was pending? Ok, remove it from upload queue.
+            if name in pending:
+                cache.delete(name)
+                del pending[pending.index(name)]
+            else:  # otherwise, mark it for deletion
+                deleting.append(name)
+            cache.set(deleting_key, deleting)
+            cache.set(pending_key, pending)
+
+    def save(self, name, content, max_length=None):
+        # Django < 1.8 doesn't take max_length.
+        if max_length is None:
+            new_name = super(S3PendingStorage, self).save(name, content)
+        else:
+            new_name = super(S3PendingStorage, self).save(name, content,
+                                                          max_length)
         if not is_production:
             return new_name
-        cache.set(new_name, True)
-        pending = cache.get(pending_key, [])
-        if not new_name in pending:
-            pending.append(new_name)
-        cache.set(pending_key, pending)
+        with pending_lock(cache):
+            pending = cache.get(pending_key, [])
+            # Remember when it was queued, to tell how far behind uploads
+            # are.
+            if not new_name in pending or not cache.get(new_name):
+                cache.set(new_name, time.time())
+            if not new_name in pending:
+                pending.append(new_name)
+            cache.set(pending_key, pending)
+        # Try to get it to S3 now, otherwise it waits for the cron.
+        if uploader:
+            uploader.submit(new_name, self.path(new_name))
         return new_name
 
+    def get_available_name(self, name, max_length=None):
+        """Hand out a free name from an atomic cache counter, checked with a
+        single exists(), instead of an exists() check per taken name.
+
+        Each name gets a counter of how many times it was handed out, which
+        goes into the new name along with a few random characters, so names
+        can't be guessed. Unknown names, or names whose counter was evicted,
+        get Django's random suffix and start a new counter.
+        """
+        if not reserve_names:
+            return self._django_available_name(name, max_length)
+        if isinstance(name, unicode):
+            name_hash = md5(name.encode('utf-8'))
+        else:
+            name_hash = md5(name)
+        counter_key = '%s-name-%s' % (pending_key, name_hash.hexdigest())
+        try:
+            while True:
+                available_name = self._numbered_name(name,
+                    cache.incr(counter_key), max_length)
+                if not available_name or not self.exists(available_name):
+                    break
+        except ValueError:
+            # Unknown name, or its counter was evicted. Random suffixes need
+            # about one exists() each, no matter how many copies there are.
+            available_name = None
+            cache.add(counter_key, 1)
+        if not available_name:
+            return self._django_available_name(name, max_length)
+        return available_name
+
+    def _numbered_name(self, name, count, max_length=None):
+        """Add the count and a random string to a name, shortening it to
+        max_length. None if it can't be shortened enough.
+        """
+        dir_name, file_name = os.path.split(name)
+        file_root, file_ext = os.path.splitext(file_name)
+        suffix = '_%s_%s' % (count, get_random_string(4))
+        numbered_name = os.path.join(dir_name,
+                                     file_root + suffix + file_ext)
+        if max_length and len(numbered_name) > max_length:
+            truncation = len(numbered_name) - max_length
+            if truncation >= len(file_root):
+                return None
+            numbered_name = os.path.join(dir_name,
+                file_root[:-truncation] + suffix + file_ext)
+        return numbered_name
+
+    def _django_available_name(self, name, max_length):
+        # Django < 1.8 doesn't take max_length.
+        if max_length is None:
+            return super(S3PendingStorage, self).get_available_name(name)
+        return super(S3PendingStorage, self).get_available_name(
+            name, max_length=max_length)
+
     def url(self, name):
         url = super(S3PendingStorage, self).url(name)
         # Is this file pending? Return local URL.
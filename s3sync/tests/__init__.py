@@ -0,0 +1,9 @@
+# Django < 1.6 only looks for tests in s3sync.tests itself.
+from s3sync.tests.test_audit import *
+from s3sync.tests.test_dirstate import *
+from s3sync.tests.test_journal import *
+from s3sync.tests.test_listing import *
+from s3sync.tests.test_media import *
+from s3sync.tests.test_stats import *
+from s3sync.tests.test_storage import *
+from s3sync.tests.test_uploader import *
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from boto.s3.key import Key
+from django.core.management import call_command
+
+from s3sync.management.commands import s3sync_audit
+from s3sync.management.commands.s3sync_audit import Command
+from s3sync.storage import cache
+from s3sync.tests.test_listing import FakeBucket, FakeConnection
+from s3sync.utils import get_pending_key
+
+
+# '-' and '.' sort before '/', '0' after it, so a plain directory walk
+# wouldn't list these in S3 order.
+NAMES = ['a-b.txt', 'a.txt', 'a/x.txt', 'a/y/z.txt', 'a0.txt', 'b/c/d.txt',
+         'b/e.txt', 'c.txt']
+
+
+class AuditTest(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        for name in NAMES:
+            filename = os.path.join(self.location, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            open(filename, 'w').write(name)
+        self.command = Command()
+        self.command.DIRECTORY = self.location
+        self.command.EXCLUDE_LIST = []
+        self.command.pending = set()
+        self.command.verbosity = 0
+        self.command.do_gzip = True
+        self.command.mismatched = []
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def local_files(self, after='', before=''):
+        return list(self.command.local_files('', after, before))
+
+    def test_s3_order(self):
+        self.assertEqual(NAMES, self.local_files())
+
+    def test_range(self):
+        for after, before in [('a.txt', ''), ('a/', 'b/'), ('a/x.txt', ''),
+                              ('a/y', 'b/e.txt'), ('', 'a/y/z.txt'),
+                              ('a0', 'a0.txt'), ('c.txt', '')]:
+            self.assertEqual([name for name in NAMES if name > after and
+                              (not before or name < before)],
+                             self.local_files(after, before),
+                             (after, before))
+
+    def test_subdir(self):
+        self.assertEqual(['a/x.txt', 'a/y/z.txt'],
+                         list(self.command.local_files('a/', '', '')))
+
+    def test_skips_excluded_and_pending(self):
+        self.command.EXCLUDE_LIST = ['a', '*.tmp']
+        self.command.pending = set(['b/e.txt'])
+        open(os.path.join(self.location, 'b', 'f.tmp'), 'w').close()
+        self.assertEqual(['a-b.txt', 'a.txt', 'a0.txt', 'b/c/d.txt',
+                          'c.txt'], self.local_files())
+
+    def test_check(self):
+        key = Key(name='a.txt')
+        key.size = len('a.txt')
+        key.etag = '"%s"' % 'wrong'
+        self.command.check('a.txt', key)
+        self.command.check('a0.txt', None)
+        self.assertEqual(['a.txt', 'a0.txt'], self.command.mismatched)
+
+    def test_check_deleted_file(self):
+        key = Key(name='a.txt')
+        key.size = 1
+        os.remove(os.path.join(self.location, 'a.txt'))
+        self.command.check('a.txt', key)
+        self.assertEqual([], self.command.mismatched)
+
+
+class AuditCommandTest(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        for name in ['css/a.css', 'js/b.js', 'uploads/u1.jpg']:
+            os.makedirs(os.path.join(self.location, os.path.dirname(name)))
+            open(os.path.join(self.location, name), 'w').close()
+        self._get_s3_connection = s3sync_audit.get_s3_connection
+        bucket = FakeBucket([])
+        s3sync_audit.get_s3_connection = lambda: FakeConnection(bucket)
+        cache.clear()
+
+    def tearDown(self):
+        s3sync_audit.get_s3_connection = self._get_s3_connection
+        shutil.rmtree(self.location)
+        cache.clear()
+
+    def test_subdir_enqueue(self):
+        """Assets next to the uploads aren't queued for the upload bucket."""
+        call_command('s3sync_audit', dir=self.location, prefix='media',
+                     subdir='uploads', enqueue=True, workers=1)
+        self.assertEqual(['uploads/u1.jpg'], cache.get(get_pending_key()))
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from s3sync.dirstate import DirectoryState
+
+
+PARAMS = [{'bucket': 'bucket', 'prefix': '', 'dir': '/media'}]
+
+
+class DirectoryStateTest(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.path = os.path.join(self.location, 'sync.state')
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_round_trip(self):
+        state = DirectoryState(self.path, PARAMS)
+        self.assertFalse(state.load())
+        state.record('/media', 100.5, 3, ['img', 'caf\xc3\xa9'])
+        state.record('/media/caf\xc3\xa9', 200.0, 0, [])
+        state.save(deep_scan=True)
+
+        state = DirectoryState(self.path, PARAMS)
+        self.assertTrue(state.load())
+        self.assertTrue(state.deep_scan)
+        self.assertEqual(['img', 'caf\xc3\xa9'],
+                         state.unchanged('/media', 100.5, 3))
+        self.assertEqual([u'img', u'caf\xe9'],
+                         state.unchanged(u'/media', 100.5, 3))
+        self.assertEqual([], state.unchanged('/media/caf\xc3\xa9', 200.0, 0))
+        # Anything added, removed or renamed changes mtime or entry count.
+        self.assertEqual(None, state.unchanged('/media', 101.0, 3))
+        self.assertEqual(None, state.unchanged('/media', 100.5, 4))
+        self.assertEqual(None, state.unchanged('/media/img', 100.5, 3))
+
+    def test_only_this_run_is_kept(self):
+        state = DirectoryState(self.path, PARAMS)
+        state.record('/media/old', 1.0, 0, [])
+        state.save()
+        state = DirectoryState(self.path, PARAMS)
+        state.load()
+        state.record('/media/new', 1.0, 0, [])
+        state.save()
+
+        state = DirectoryState(self.path, PARAMS)
+        state.load()
+        self.assertEqual(None, state.unchanged('/media/old', 1.0, 0))
+        self.assertEqual([], state.unchanged('/media/new', 1.0, 0))
+
+    def test_other_run(self):
+        DirectoryState(self.path, PARAMS).save()
+        other = [dict(PARAMS[0], bucket='other')]
+        self.assertFalse(DirectoryState(self.path, other).load())
+
+    def test_undecodable_names(self):
+        state = DirectoryState(self.path, PARAMS)
+        state.record('/media', 1.0, 1, ['caf\xe9'])
+        state.record('/media/caf\xe9', 1.0, 0, [])
+        state.save()
+
+        state = DirectoryState(self.path, PARAMS)
+        state.load()
+        self.assertEqual(None, state.unchanged('/media', 1.0, 1))
+        self.assertEqual(None, state.unchanged('/media/caf\xe9', 1.0, 0))
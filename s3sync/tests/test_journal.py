@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from s3sync.journal import JournalLockedError, SyncJournal
+
+
+PARAMS = {'bucket': 'bucket', 'prefix': '', 'dir': '/media'}
+
+
+class SyncJournalTest(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.path = os.path.join(self.location, 'sync.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def reopen(self):
+        journal = SyncJournal(self.path, PARAMS)
+        self.assertTrue(journal.load())
+        return journal
+
+    def test_resume(self):
+        journal = SyncJournal(self.path, PARAMS)
+        journal.open()
+        journal.dir_done('/media/img')
+        journal.key_done('img/a.jpg')
+        journal.close()
+
+        journal = self.reopen()
+        self.assertTrue(journal.is_dir_done('/media/img'))
+        self.assertTrue(journal.is_key_done('img/a.jpg'))
+        self.assertFalse(journal.is_key_done('img/b.jpg'))
+
+    def test_other_run(self):
+        journal = SyncJournal(self.path, PARAMS)
+        journal.open()
+        journal.close()
+        other = dict(PARAMS, bucket='other')
+        self.assertFalse(SyncJournal(self.path, other).load())
+
+    def test_utf8_names(self):
+        journal = SyncJournal(self.path, PARAMS)
+        journal.open()
+        journal.dir_done('/media/caf\xc3\xa9')
+        journal.key_done(u'caf\xe9/men\xfc.jpg')
+        journal.close()
+
+        journal = self.reopen()
+        self.assertTrue(journal.is_dir_done('/media/caf\xc3\xa9'))
+        self.assertTrue(journal.is_dir_done(u'/media/caf\xe9'))
+        self.assertTrue(journal.is_key_done('caf\xc3\xa9/men\xc3\xbc.jpg'))
+        self.assertTrue(journal.is_key_done(u'caf\xe9/men\xfc.jpg'))
+
+    def test_undecodable_names(self):
+        journal = SyncJournal(self.path, PARAMS)
+        journal.open()
+        journal.dir_done('/media/caf\xe9')
+        journal.key_done('caf\xe9/a.jpg')
+        journal.key_done('b.jpg')
+        journal.close()
+
+        journal = self.reopen()
+        self.assertFalse(journal.is_dir_done('/media/caf\xe9'))
+        self.assertFalse(journal.is_key_done('caf\xe9/a.jpg'))
+        self.assertTrue(journal.is_key_done('b.jpg'))
+
+    def test_torn_line(self):
+        journal = SyncJournal(self.path, PARAMS)
+        journal.open()
+        journal.key_done('a.jpg')
+        journal.close()
+        # Killed halfway through writing an entry.
+        journal_file = open(self.path, 'a')
+        journal_file.write('{"k": "b.j')
+        journal_file.close()
+
+        journal = self.reopen()
+        journal.open(resume=True)
+        journal.key_done('c.jpg')
+        journal.close()
+
+        journal = self.reopen()
+        self.assertEqual(set(['a.jpg', 'c.jpg']), journal.keys)
+
+    def test_lock(self):
+        journal = SyncJournal(self.path, PARAMS)
+        journal.lock()
+        journal.open()
+        journal.key_done('a.jpg')
+
+        other = SyncJournal(self.path, PARAMS)
+        self.assertRaises(JournalLockedError, other.lock)
+
+        journal.finish()
+        other.lock()
+        self.assertFalse(other.load())
+        other.close()
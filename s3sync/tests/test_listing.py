@@ -0,0 +1,183 @@
+import threading
+from unittest import TestCase
+
+from boto.s3.key import Key
+from boto.s3.prefix import Prefix
+
+from s3sync import listing
+from s3sync.listing import (find_partitions, parallel_bucket_lister,
+    parallel_head)
+
+
+class ResultSet(list):
+    is_truncated = False
+    next_marker = None
+
+
+class FakeBucket(object):
+    """Lists keys like S3 does, a few per request."""
+
+    def __init__(self, names, max_keys=6, fail_prefix=None):
+        self.name = 'bucket'
+        self.names = sorted(names)
+        self.max_keys = max_keys
+        self.fail_prefix = fail_prefix
+
+    def get_all_keys(self, prefix='', marker='', delimiter='', **kwargs):
+        if not delimiter and self.fail_prefix and \
+            prefix.startswith(self.fail_prefix):
+            raise IOError('Listing %s failed' % prefix)
+        result = ResultSet()
+        for name in self.names:
+            if not name.startswith(prefix) or name <= marker:
+                continue
+            # A common prefix as marker skips everything under it.
+            if delimiter and marker.endswith(delimiter) and \
+                name.startswith(marker):
+                continue
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                item = Prefix(self, prefix + rest[:rest.index(delimiter) + 1])
+                if result and result[-1].name == item.name:
+                    continue
+            else:
+                item = Key(self, name)
+            if len(result) == self.max_keys:
+                result.is_truncated = True
+                if delimiter:
+                    result.next_marker = result[-1].name
+                break
+            result.append(item)
+        return result
+
+    def get_key(self, name):
+        if self.fail_prefix and name.startswith(self.fail_prefix):
+            raise IOError('HEAD %s failed' % name)
+        if name in self.names:
+            return Key(self, name)
+        return None
+
+
+class FakeConnection(object):
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get_bucket(self, name, validate=True):
+        return self.bucket
+
+
+# b/c/ and c/ hold more than a page of keys, they are listed by workers.
+NAMES = sorted(['a.txt', 'b/1.txt', 'b/2.txt', 'b/d.txt', 'b0.txt',
+                'd/e/f/1.txt', 'd/e/f/2.txt', 'd/e/g.txt', 'e.txt'] +
+               ['b/c/%02d.txt' % i for i in range(1, 10)] +
+               ['c/%02d.txt' % i for i in range(1, 10)])
+
+
+class ParallelBucketListerTest(TestCase):
+
+    def setUp(self):
+        self._get_s3_connection = listing.get_s3_connection
+        self.bucket = FakeBucket(NAMES)
+        listing.get_s3_connection = lambda: FakeConnection(self.bucket)
+
+    def tearDown(self):
+        listing.get_s3_connection = self._get_s3_connection
+
+    def list_names(self, **kwargs):
+        return [key.name for key in parallel_bucket_lister(
+            self.bucket, workers=4, page_size=3, **kwargs)]
+
+    def test_sorted(self):
+        self.assertEqual(NAMES, self.list_names())
+
+    def test_paged_partitions(self):
+        # Fewer entries per request than a directory holds.
+        self.bucket.max_keys = 2
+        self.assertEqual(NAMES, self.list_names())
+        self.assertEqual([name for name in NAMES if name > 'b/c/02.txt'],
+                         self.list_names(marker='b/c/02.txt'))
+
+    def test_prefix(self):
+        self.assertEqual([name for name in NAMES if name.startswith('b/')],
+                         self.list_names(prefix='b/'))
+
+    def test_marker(self):
+        for marker in ['a.txt', 'b/', 'b/1.txt', 'b/c/', 'b/c/02.txt',
+                       'b/c/020', 'b/d.txt', 'b0', 'c/05.txt', 'd/e/f/1.txt',
+                       'e.txt', 'z']:
+            self.assertEqual([name for name in NAMES if name > marker],
+                             self.list_names(marker=marker), marker)
+
+    def test_wide_bucket(self):
+        # More directories at the top than a request lists.
+        self.bucket.names = sorted('%02d/%d.txt' % (i, j)
+                                   for i in range(20) for j in range(3))
+        partitions, keys = find_partitions(self.bucket, count=16)
+        self.assertEqual(['%02d/' % i for i in range(20)], partitions)
+        self.assertEqual(self.bucket.names, self.list_names())
+        self.assertEqual([name for name in self.bucket.names
+                          if name > '07/1.txt'],
+                         self.list_names(marker='07/1.txt'))
+
+    def test_big_directory_kept_whole(self):
+        partitions, keys = find_partitions(self.bucket, max_keys=2)
+        self.assertEqual([''], partitions)
+        self.assertEqual([], keys)
+
+    def test_single_worker(self):
+        self.assertEqual(
+            [name for name in NAMES if name > 'b/c/02.txt'],
+            [key.name for key in parallel_bucket_lister(
+                self.bucket, marker='b/c/02.txt', workers=1)])
+
+    def test_failure(self):
+        self.bucket.fail_prefix = 'c/'
+        names = []
+        try:
+            for key in parallel_bucket_lister(self.bucket, workers=4,
+                                             page_size=3):
+                names.append(key.name)
+        except IOError:
+            pass
+        else:
+            self.fail('Listing error not raised')
+        self.assertEqual([name for name in NAMES if name < 'c/'], names)
+
+    def test_close_stops_workers(self):
+        keys = parallel_bucket_lister(self.bucket, workers=4, page_size=1,
+                                      pages_ahead=1)
+        keys.next()
+        keys.close()
+        self.assertEqual([], [thread for thread in threading.enumerate()
+                              if thread.name.startswith('s3sync-lister')])
+
+
+class ParallelHeadTest(TestCase):
+
+    def setUp(self):
+        self._get_s3_connection = listing.get_s3_connection
+        self.bucket = FakeBucket(NAMES)
+        listing.get_s3_connection = lambda: FakeConnection(self.bucket)
+
+    def tearDown(self):
+        listing.get_s3_connection = self._get_s3_connection
+
+    def workers(self):
+        return [thread for thread in threading.enumerate()
+                if thread.name.startswith('s3sync-head')]
+
+    def test_head(self):
+        names = ['a.txt', 'b/c/05.txt', 'missing.txt', 'c/']
+        found = dict((name, key and key.name) for name, key in
+                     parallel_head(self.bucket, names, workers=3))
+        self.assertEqual({'a.txt': 'a.txt', 'b/c/05.txt': 'b/c/05.txt',
+                          'missing.txt': None, 'c/': None}, found)
+        self.assertEqual([], self.workers())
+
+    def test_failure_stops_workers(self):
+        self.bucket.fail_prefix = 'c/'
+        names = ['c/%02d.txt' % i for i in range(1, 10)] * 10
+        self.assertRaises(IOError, list,
+                          parallel_head(self.bucket, names, workers=4))
+        self.assertEqual([], self.workers())
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from boto.s3.key import Key
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test.utils import override_settings
+
+from s3sync.management.commands import s3sync_media
+from s3sync.management.commands.s3sync_media import Command, SyncTarget
+from s3sync.tests.test_listing import FakeBucket
+
+
+class RecordingBucket(FakeBucket):
+
+    def __init__(self, name, names):
+        super(RecordingBucket, self).__init__(names)
+        self.name = name
+        self.deleted = []
+
+    def delete_key(self, name):
+        self.deleted.append(name)
+
+
+class BucketsConnection(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def get_bucket(self, name, validate=True):
+        return self.buckets[name]
+
+
+class SyncJobTest(TestCase):
+    """The example job: assets from the whole media directory except the
+    uploads, which go to their own bucket."""
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        for name in ['css/a.css', 'js/b.js', 'less/c.less', '.hidden',
+                     'uploads/u1.jpg', 'uploads/sub/u2.jpg',
+                     'uploads/.htaccess']:
+            filename = os.path.join(self.location, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            open(filename, 'w').close()
+        self.uploads_dir = os.path.join(self.location, 'uploads')
+        self.assets = RecordingBucket('assets', ['media/old.css'])
+        self.uploads = RecordingBucket('uploads', ['media/uploads/gone.jpg'])
+        self.uploaded = []
+        self._get_s3_connection = s3sync_media.get_s3_connection
+        self._upload_file_to_s3 = s3sync_media.upload_file_to_s3
+        connection = BucketsConnection({'assets': self.assets,
+                                     'uploads': self.uploads})
+        s3sync_media.get_s3_connection = lambda: connection
+        s3sync_media.upload_file_to_s3 = self.upload
+        self.synced = []
+        self._upload_s3 = Command.upload_s3
+        upload_s3 = Command.upload_s3
+
+        def recording_upload_s3(command, target, dirname, *args):
+            self.synced.append((target.bucket_name, dirname))
+            return upload_s3(command, target, dirname, *args)
+        Command.upload_s3 = recording_upload_s3
+
+    def tearDown(self):
+        s3sync_media.get_s3_connection = self._get_s3_connection
+        s3sync_media.upload_file_to_s3 = self._upload_file_to_s3
+        Command.upload_s3 = self._upload_s3
+        shutil.rmtree(self.location)
+
+    def upload(self, file_key, filename, key, **kwargs):
+        self.uploaded.append((key.bucket.name, file_key))
+
+    def jobs(self):
+        return {'media': [
+            {'bucket': 'assets', 'prefix': 'media', 'dir': self.location,
+             'exclude_list': ['.*', 'uploads*', 'less'],
+             'remove_missing': True,
+             'journal': os.path.join(self.location, '.assets.journal')},
+            {'bucket': 'uploads', 'prefix': 'media/uploads',
+             'dir': self.uploads_dir, 'exclude_list': ['.htaccess'],
+             'remove_missing': True,
+             'journal': os.path.join(self.location, '.uploads.journal')},
+        ]}
+
+    def test_job(self):
+        with override_settings(BUCKET_SYNC_JOBS=self.jobs()):
+            call_command('s3sync_media', job='media', list_workers=1,
+                         verbosity=0)
+        # Each directory once, by the targets it belongs to.
+        path = lambda name: os.path.join(self.location, name)
+        self.assertEqual([('assets', self.location),
+                          ('assets', path('css')),
+                          ('assets', path('js')),
+                          ('uploads', path('uploads')),
+                          ('uploads', path('uploads/sub'))],
+                         sorted(self.synced))
+        self.assertEqual([('assets', 'media/css/a.css'),
+                          ('assets', 'media/js/b.js'),
+                          ('uploads', 'media/uploads/sub/u2.jpg'),
+                          ('uploads', 'media/uploads/u1.jpg')],
+                         sorted(self.uploaded))
+        self.assertEqual(['media/old.css'], self.assets.deleted)
+        self.assertEqual(['media/uploads/gone.jpg'], self.uploads.deleted)
+
+    def test_job_rejects_target_options(self):
+        with override_settings(BUCKET_SYNC_JOBS=self.jobs()):
+            for option in [{'bucket': 'assets'}, {'prefix': 'media'},
+                           {'dir': self.location}, {'gzip': True},
+                           {'remove_missing': True}, {'journal': '/tmp/j'}]:
+                self.assertRaises(CommandError, call_command, 's3sync_media',
+                                  job='media', verbosity=0, **option)
+        self.assertEqual([], self.uploaded)
+
+    def test_sync_dir(self):
+        command = Command()
+        command.verbosity = 0
+        command.upload_s3 = lambda target, dirname, files, unchanged: True
+        command.targets = [SyncTarget('assets', self.location,
+                                      exclude_list=['uploads*', 'less']),
+                           SyncTarget('uploads', self.uploads_dir)]
+        assets, uploads = command.targets
+        path = lambda name: os.path.join(self.location, name)
+
+        self.assertEqual((True, True), command.sync_dir(self.location, []))
+        self.assertEqual((False, True), command.sync_dir(path('less'), []))
+        self.assertEqual(set([path('less')]), assets.pruned)
+        self.assertFalse(assets.contains(path('less/sub')))
+        # Excluded from the assets, but the root of the uploads.
+        self.assertEqual((True, True), command.sync_dir(path('uploads'), []))
+        self.assertFalse(assets.contains(path('uploads/sub')))
+        self.assertTrue(uploads.contains(path('uploads/sub')))
+        self.assertFalse(uploads.contains(path('uploadsx')))
+
+    def test_walk_above_targets(self):
+        command = Command()
+        command.verbosity = 0
+        command.upload_s3 = lambda target, dirname, files, unchanged: True
+        command.targets = [SyncTarget('uploads', self.uploads_dir)]
+        # Nothing to sync here, but the target is further down.
+        self.assertEqual((True, True), command.sync_dir(self.location, []))
+        self.assertEqual((False, True),
+                         command.sync_dir(os.path.join(self.location, 'css'),
+                                          []))
@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from s3sync.stats import (cache, get_latency_since_key, get_pending_stats,
+    record_upload)
+
+
+class UploadStatsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_histogram(self):
+        record_upload(100.0, now=105.0)
+        record_upload(100.0, now=130.0)
+        record_upload(100.0, now=190.0)
+        record_upload(True, now=190.0)  # queued without a timestamp
+        stats = get_pending_stats()
+        self.assertEqual(3, stats['uploaded'])
+        self.assertAlmostEqual(125 / 3.0, stats['average_latency'])
+        histogram = dict(stats['latency_histogram'])
+        self.assertEqual(1, histogram[10])
+        self.assertEqual(1, histogram[60])
+        self.assertEqual(1, histogram[300])
+        self.assertEqual(0, histogram[None])
+        self.assertTrue(stats['uploaded_since'])
+
+    def test_counters_start_over_together(self):
+        record_upload(100.0, now=105.0)
+        record_upload(100.0, now=190.0)
+        # The period ran out, even if some counters are still around.
+        cache.delete(get_latency_since_key())
+        stats = get_pending_stats()
+        self.assertEqual(0, stats['uploaded'])
+        self.assertEqual(None, stats['average_latency'])
+
+        record_upload(100.0, now=400.0)
+        stats = get_pending_stats()
+        self.assertEqual(1, stats['uploaded'])
+        self.assertAlmostEqual(300.0, stats['average_latency'])
+        self.assertEqual(1, dict(stats['latency_histogram'])[300])
@@ -0,0 +1,93 @@
+import os
+import re
+import shutil
+import tempfile
+from unittest import TestCase
+
+from django.core.files.base import ContentFile
+
+from s3sync import storage
+from s3sync.storage import S3PendingStorage, cache
+
+
+class ReserveNamesTest(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = S3PendingStorage(location=self.location)
+        self._reserve_names = storage.reserve_names
+        storage.reserve_names = True
+        cache.clear()
+
+    def tearDown(self):
+        storage.reserve_names = self._reserve_names
+        shutil.rmtree(self.location)
+        cache.clear()
+
+    def touch(self, name):
+        open(os.path.join(self.location, name), 'w').close()
+
+    def reserve(self, name, max_length=None):
+        reserved = self.storage.get_available_name(name,
+                                                   max_length=max_length)
+        self.assertFalse(os.path.exists(os.path.join(self.location,
+                                                     reserved)))
+        self.touch(reserved)
+        return reserved
+
+    def count_exists(self):
+        calls = []
+        exists = self.storage.exists
+
+        def counting_exists(name):
+            calls.append(name)
+            return exists(name)
+        self.storage.exists = counting_exists
+        return calls
+
+    def test_free_name(self):
+        self.assertEqual('avatar.jpg', self.reserve('avatar.jpg'))
+
+    def test_one_exists_per_name(self):
+        self.touch('avatar.jpg')
+        calls = self.count_exists()
+        names = [self.reserve('avatar.jpg') for i in range(50)]
+        self.assertEqual(50, len(set(names)))
+        # Django's random suffix for the first, one check each after that.
+        self.assertTrue(len(calls) < 55, len(calls))
+        for i, name in enumerate(names[1:]):
+            self.assertTrue(re.match(r'avatar_%d_\w{4}\.jpg$' % (i + 2),
+                                     name), name)
+
+    def test_skips_names_taken_on_disk(self):
+        self.touch('avatar.jpg')
+        self.reserve('avatar.jpg')
+        get_random_string = storage.get_random_string
+        storage.get_random_string = lambda length: 'abcd'
+        try:
+            self.touch('avatar_2_abcd.jpg')
+            self.assertEqual('avatar_3_abcd.jpg', self.reserve('avatar.jpg'))
+        finally:
+            storage.get_random_string = get_random_string
+
+    def test_evicted_counter(self):
+        self.touch('avatar.jpg')
+        for i in range(20):
+            self.reserve('avatar.jpg')
+        cache.clear()
+        calls = self.count_exists()
+        self.reserve('avatar.jpg')
+        self.assertTrue(len(calls) < 5, len(calls))
+
+    def test_max_length(self):
+        self.touch('avatar.jpg')
+        self.reserve('avatar.jpg', max_length=14)
+        name = self.reserve('avatar.jpg', max_length=14)
+        self.assertTrue(re.match(r'ava_2_\w{4}\.jpg$', name), name)
+
+    def test_save_with_max_length(self):
+        for reserve_names in (True, False):
+            storage.reserve_names = reserve_names
+            name = self.storage.save('file.txt', ContentFile('x'),
+                                     max_length=100)
+            self.assertTrue(self.storage.exists(name))
@@ -0,0 +1,57 @@
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+from django.core.files.base import ContentFile
+
+from s3sync import storage
+from s3sync.storage import S3PendingStorage, cache, pending_key
+from s3sync.uploader import BackgroundUploader
+
+
+class PendingQueueRaceTest(TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.storage = S3PendingStorage(location=self.location)
+        self.uploader = BackgroundUploader('bucket')
+        self._is_production = storage.is_production
+        self._uploader = storage.uploader
+        storage.is_production = True
+        storage.uploader = None
+        cache.clear()
+
+    def tearDown(self):
+        storage.is_production = self._is_production
+        storage.uploader = self._uploader
+        shutil.rmtree(self.location)
+        cache.clear()
+
+    def test_concurrent_save_and_mark_uploaded(self):
+        """Files uploaded in the background leave the queue, the others
+        saved meanwhile all stay in it."""
+        kept = []
+
+        def save(prefix):
+            for i in range(100):
+                kept.append(self.storage.save('%s-%d.txt' % (prefix, i),
+                                              ContentFile('x')))
+
+        def save_and_upload():
+            for i in range(100):
+                name = self.storage.save('uploaded-%d.txt' % i,
+                                         ContentFile('x'))
+                self.uploader._mark_uploaded(name)
+
+        threads = [threading.Thread(target=save, args=('kept-a',)),
+                   threading.Thread(target=save, args=('kept-b',)),
+                   threading.Thread(target=save_and_upload)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(kept), sorted(cache.get(pending_key, [])))
+        for name in kept:
+            self.assertTrue(cache.get(name))
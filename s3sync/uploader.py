@@ -0,0 +1,106 @@
+import logging
+import os
+import Queue
+import threading
+
+from django.conf import settings
+
+from s3sync.stats import record_upload
+from s3sync.utils import (get_bucket_and_key, get_pending_key,
+    get_s3sync_cache, pending_lock, upload_file_to_s3)
+
+
+log = logging.getLogger('s3sync')
+
+
+class BackgroundUploader(object):
+    """Upload freshly saved files to S3 from a small pool of threads.
+
+    Files are handed over only after they were queued as pending, and they
+    leave the pending queue only once uploaded. Anything the uploader cannot
+    take (queue full) or never gets to (process exits) is left for the
+    s3sync_pending cron.
+    """
+
+    def __init__(self, bucket_name, prefix='', threads=2, queue_size=100):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.threads = threads
+        self.queue_size = queue_size
+        self.cache = get_s3sync_cache()
+        self.pending_key = get_pending_key()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def submit(self, name, filename):
+        """Queue a file for upload without blocking.
+
+        Returns False if the uploader is saturated.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((name, filename))
+        except Queue.Full:
+            return False
+        return True
+
+    def _ensure_started(self):
+        # Threads don't survive a fork, start a pool per process.
+        if self._pid == os.getpid():
+            return
+        self._lock.acquire()
+        try:
+            if self._pid == os.getpid():
+                return
+            self._queue = Queue.Queue(self.queue_size)
+            for i in range(self.threads):
+                worker = threading.Thread(target=self._work,
+                                          args=(self._queue,),
+                                          name='s3sync-uploader-%d' % i)
+                worker.daemon = True
+                worker.start()
+            self._pid = os.getpid()
+        finally:
+            self._lock.release()
+
+    def _work(self, queue):
+        # Each thread has its own connection, boto's aren't thread safe.
+        bucket, key = None, None
+        while True:
+            name, filename = queue.get()
+            if self.prefix:
+                file_key = '%s/%s' % (self.prefix, name)
+            else:
+                file_key = name
+            try:
+                if key is None:
+                    bucket, key = get_bucket_and_key(self.bucket_name)
+                upload_file_to_s3(file_key, filename, key,
+                    do_gzip=True, do_expires=True)
+            except Exception:
+                # Still pending, the cron will pick it up.
+                log.exception('Background upload of %s failed.' % file_key)
+                bucket, key = None, None
+            else:
+                self._mark_uploaded(name)
+
+    def _mark_uploaded(self, name):
+        record_upload(self.cache.get(name))
+        with pending_lock(self.cache):
+            self.cache.delete(name)
+            pending = self.cache.get(self.pending_key, [])
+            if name in pending:
+                del pending[pending.index(name)]
+                self.cache.set(self.pending_key, pending)
+
+
+def get_background_uploader():
+    """Build the uploader configured in settings, or None if disabled."""
+    if not getattr(settings, 'BUCKET_UPLOADS_BACKGROUND', False):
+        return None
+    return BackgroundUploader(settings.BUCKET_UPLOADS,
+        prefix=getattr(settings, 'BUCKET_UPLOADS_PENDING_PREFIX', ''),
+        threads=getattr(settings, 'BUCKET_UPLOADS_BACKGROUND_THREADS', 2),
+        queue_size=getattr(settings, 'BUCKET_UPLOADS_BACKGROUND_QUEUE_SIZE',
+                           100))
@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 import datetime
 import email
 import mimetypes
@@ -24,10 +25,31 @@ class ConfigMissingError(Exception):
     pass
 
 
-def get_bucket_and_key(name):
-    """Connect to S3 and grab bucket and key."""
+def encode_path(name):
+    """Return a path as a UTF-8 byte string, like the ones os.listdir
+    gives us. None if it's a byte string that isn't valid UTF-8, which
+    can't be saved as JSON."""
+    if isinstance(name, unicode):
+        return name.encode('utf-8')
+    try:
+        name.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    return name
+
+
+def get_s3_connection():
     key, secret, host = get_aws_info()
-    conn = S3Connection(key, secret, host=host)
+    return S3Connection(key, secret, host=host)
+
+
+def get_bucket_and_key(name, conn=None):
+    """Connect to S3 and grab bucket and key.
+
+    Pass an existing connection to reuse it for several buckets.
+    """
+    if conn is None:
+        conn = get_s3_connection()
     try:
         bucket = conn.get_bucket(name)
     except boto.exception.S3ResponseError:
@@ -58,10 +80,30 @@ def get_s3sync_cache():
                                         'default'))
 
 
+@contextmanager
+def pending_lock(cache, timeout=10, wait=0.005):
+    """Hold the lock on the pending lists while reading and writing them
+    back, so concurrent updates from other threads or servers don't get
+    lost. The lock expires after timeout seconds in case its holder dies."""
+    lock_key = '%s-lock' % get_pending_key()
+    while not cache.add(lock_key, True, timeout):
+        time.sleep(wait)
+    try:
+        yield
+    finally:
+        cache.delete(lock_key)
+
+
 def guess_mimetype(f):
     return mimetypes.guess_type(f)[0]
 
 
+def should_gzip(content_type, file_size):
+    # Gzipping only if file is large enough (>1K is recommended)
+    # and only if file is a common text type (not a binary file)
+    return file_size > 1024 and content_type in GZIP_CONTENT_TYPES
+
+
 def upload_file_to_s3(file_key, filename, key, do_gzip=False,
                     do_expires=False, verbosity=0):
     """Details about params:
@@ -77,9 +119,7 @@ def upload_file_to_s3(file_key, filename, key, do_gzip=False,
     file_size = os.fstat(file_obj.fileno()).st_size
     filedata = file_obj.read()
     if do_gzip:
-        # Gzipping only if file is large enough (>1K is recommended)
-        # and only if file is a common text type (not a binary file)
-        if (file_size > 1024 and content_type in GZIP_CONTENT_TYPES):
+        if should_gzip(content_type, file_size):
             filedata = compress_string(filedata)
             headers['Content-Encoding'] = 'gzip'
             gzip_file_size = len(filedata)